@@ -91,6 +91,14 @@ CREATE INDEX idx_cdc_id_current ON sales_records_cdc(id, is_current);
 -- Index on row_hash for change detection optimization
 CREATE INDEX idx_cdc_row_hash ON sales_records_cdc(row_hash);
 
+-- Partial index covering only active versions: lookups and expirations
+-- filter on is_current = 1, so this B-tree stays small no matter how much
+-- history accumulates
+-- (Named to match the index the pipeline creates on demand, so older
+-- databases upgraded at runtime don't end up with a duplicate)
+CREATE INDEX idx_sales_records_cdc_active ON sales_records_cdc(id, is_current)
+    WHERE is_current = 1;
+
 -- ============================================================================
 -- VERIFICATION QUERIES
 -- ============================================================================